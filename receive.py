@@ -13,10 +13,15 @@ Usage:
     python ble_receiver.py --device-address XX:XX:XX:XX:XX:XX
 """
 
+import array
 import asyncio
+import binascii
 import struct
 import argparse
+import os
+import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Optional
 
@@ -34,25 +39,105 @@ UUID_TX_DATA    = "a3f9b7f0-52d1-4c7a-8f1c-7a1b9b2f0002"  # notify, up to 244B
 UUID_RX_CREDITS = "a3f9b7f0-52d1-4c7a-8f1c-7a1b9b2f0003"  # write w/o resp, 1B
 UUID_FILE_INFO  = "a3f9b7f0-52d1-4c7a-8f1c-7a1b9b2f0004"  # read: [u32 size][name...]
 
+# Every data packet except the last carries exactly this many payload bytes,
+# so a packet's file offset is always seq * PAYLOAD_STRIDE
+PAYLOAD_STRIDE = 236
+
+def _build_crc16_table() -> array.array:
+    """Precompute the CRC16-CCITT byte-wise lookup table (polynomial 0x1021)"""
+    table = array.array('H', [0] * 256)
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            if crc & 0x8000:
+                crc = ((crc << 1) ^ 0x1021) & 0xFFFF
+            else:
+                crc = (crc << 1) & 0xFFFF
+        table[byte] = crc
+    return table
+
+_CRC16_CCITT_TABLE = _build_crc16_table()
+
+def _select_crc16():
+    """Pick the fastest available C implementation of the device CRC
+
+    binascii.crc_hqx is bit-exact for the device polynomial (0x1021,
+    init 0xFFFF, unreflected); crcmod's generated function is equivalent
+    and covers interpreters where crc_hqx is unavailable. Returns None if
+    neither exists, in which case the pure-Python table version is used.
+    """
+    if hasattr(binascii, 'crc_hqx'):
+        return lambda data: binascii.crc_hqx(data, 0xFFFF)
+    try:
+        from crcmod import mkCrcFun
+    except ImportError:
+        return None
+    return mkCrcFun(0x11021, initCrc=0xFFFF, rev=False, xorOut=0x0000)
+
+_fast_crc16 = _select_crc16()
+
+# Credit counts fit in one unsigned byte; pre-build every possible payload
+# so send_credits never allocates
+_CREDIT_BYTES = [bytes([i]) for i in range(256)]
+
 class XiaoAudioReceiver:
-    def __init__(self):
+    # Packet header layout: [seq u32 | len u16 | crc u16], little-endian
+    _HDR = struct.Struct('<IHH')
+
+    def __init__(self, strict_crc: bool = False):
         self.client: Optional[BleakClient] = None
+        # CRC failures are rare, so by default each packet's received CRC is
+        # only recorded on the hot path and checked in one pass after the
+        # transfer; strict mode keeps the original per-packet verification
+        self._strict_crc = strict_crc
+        self._packet_crcs = array.array('H')
+        # Resolved characteristic objects; passing these to bleak skips the
+        # per-call UUID string lookup
+        self._rx_credits_char = None
+        self._tx_data_char = None
         self.file_size = 0
         self.file_name = ""
-        self.received_data = bytearray()
+        # Packets stream straight to the output file; no in-memory copy
+        self._fd: Optional[int] = None
+        self._file_mmap = None
+        self._output_path: Optional[Path] = None
+        self._bytes_written = 0
         self.expected_seq = 0
         self.total_packets = 0
         self.credits_sent = 0
+        self._pending_credits = 0
         self.start_time = 0
-        self.file_transfer_complete = False
-        
-        # Packet reordering buffer for out-of-order packets
-        self.packet_buffer = {}  # seq -> payload
-        self.max_buffer_size = 100  # Maximum packets to buffer
+        self._done = asyncio.Event()
+
+        # Out-of-order packets are written straight into the preallocated
+        # buffer; this bitmap records which sequence numbers have arrived
+        self.expected_packets = 0
+        self._received_bits = bytearray()
+        self._packets_stored = 0
         self.last_progress_update = 0
+        self._size_str = "0"
         
     def crc16_ccitt(self, data: bytes) -> int:
-        """Calculate CRC16-CCITT checksum (same as device)"""
+        """Calculate CRC16-CCITT checksum (same as device)
+
+        Delegates to a C implementation (binascii.crc_hqx, or a
+        crcmod-generated function) so the whole payload is checksummed in a
+        single call instead of a Python byte loop. Accepts any
+        buffer-protocol object (bytes, bytearray, memoryview).
+        """
+        if _fast_crc16 is not None:
+            return _fast_crc16(data)
+        return self._table_crc16(data)
+
+    def _table_crc16(self, data: bytes, _table=_CRC16_CCITT_TABLE) -> int:
+        """Pure-Python table-driven CRC16-CCITT (last-resort fallback)"""
+        crc = 0xFFFF
+        for byte in data:
+            crc = ((crc << 8) ^ _table[((crc >> 8) ^ byte) & 0xFF]) & 0xFFFF
+        return crc
+
+    def _reference_crc16(self, data: bytes) -> int:
+        """Bit-by-bit CRC16-CCITT (slow reference for verifying the table version)"""
         crc = 0xFFFF
         for byte in data:
             crc ^= byte << 8
@@ -66,34 +151,29 @@ class XiaoAudioReceiver:
     async def scan_for_device(self, timeout=10) -> Optional[BLEDevice]:
         """Scan for XIAO-REC device"""
         print(f"Scanning for BLE devices (timeout: {timeout}s)...")
-        
-        devices = await BleakScanner.discover(timeout=timeout)
-        
-        print(f"Found {len(devices)} BLE devices:")
+
+        # return_adv gives typed AdvertisementData with service_uuids, so
+        # one pass covers both the name and service-UUID checks
+        found = await BleakScanner.discover(timeout=timeout, return_adv=True)
+
+        print(f"Found {len(found)} BLE devices:")
         xiao_device = None
-        
-        for device in devices:
+        uuid_svc_file = UUID_SVC_FILE.lower()
+
+        for device, adv in found.values():
             # Print all devices for debugging
             print(f"  - {device.name or 'Unknown'} ({device.address})")
-            
+
             # Check various possible names
-            if device.name:
-                if "XIAO" in device.name.upper() or "REC" in device.name.upper():
-                    print(f"  ✓ Potential XIAO device found: {device.name}")
-                    xiao_device = device
-        
-        # Also check by service UUID
-        for device in devices:
-            # Get device details
-            try:
-                # Check if device advertises our service UUID
-                if hasattr(device, 'metadata') and 'uuids' in device.metadata:
-                    if UUID_SVC_FILE.lower() in [uuid.lower() for uuid in device.metadata['uuids']]:
-                        print(f"  ✓ Found device with matching service UUID: {device.address}")
-                        xiao_device = device
-            except:
-                pass
-                
+            if device.name and ("XIAO" in device.name.upper() or "REC" in device.name.upper()):
+                print(f"  ✓ Potential XIAO device found: {device.name}")
+                xiao_device = device
+
+            # Check if device advertises our service UUID
+            if uuid_svc_file in (uuid.lower() for uuid in adv.service_uuids):
+                print(f"  ✓ Found device with matching service UUID: {device.address}")
+                xiao_device = device
+
         if xiao_device:
             print(f"\nSelected device: {xiao_device.name or 'Unknown'} ({xiao_device.address})")
             return xiao_device
@@ -105,19 +185,23 @@ class XiaoAudioReceiver:
             return None
     
     async def connect_to_device(self, device: BLEDevice) -> bool:
-        """Connect to the BLE device"""
+        """Connect to a discovered BLE device"""
+        return await self.connect_to_address(device.address)
+
+    async def connect_to_address(self, address: str) -> bool:
+        """Connect directly by address, without requiring a prior scan"""
         try:
-            print(f"Connecting to {device.address}...")
-            self.client = BleakClient(device.address)
+            print(f"Connecting to {address}...")
+            self.client = BleakClient(address)
             await self.client.connect()
-            
+
             if self.client.is_connected:
                 print("✓ Connected successfully")
                 return True
             else:
                 print("✗ Connection failed")
                 return False
-                
+
         except Exception as e:
             print(f"Connection error: {e}")
             return False
@@ -143,8 +227,12 @@ class XiaoAudioReceiver:
             else:
                 self.file_name = name_bytes.decode('utf-8').rstrip('\x00')
             
+            # Format the constant size fragment once; the progress line
+            # reprints it on every update
+            self._size_str = f"{self.file_size:,}"
+
             print(f"File: {self.file_name}")
-            print(f"Size: {self.file_size:,} bytes ({self.file_size/1024:.1f} KB)")
+            print(f"Size: {self._size_str} bytes ({self.file_size/1024:.1f} KB)")
             
             return True
             
@@ -155,215 +243,353 @@ class XiaoAudioReceiver:
     async def send_credits(self, credits: int):
         """Send credits to device for flow control"""
         try:
-            await self.client.write_gatt_char(UUID_RX_CREDITS, bytes([credits]), response=False)
+            char = self._rx_credits_char or UUID_RX_CREDITS
+            await self.client.write_gatt_char(char, _CREDIT_BYTES[credits], response=False)
             self.credits_sent += credits
         except Exception as e:
             print(f"Error sending credits: {e}")
     
+    def _write_payload(self, seq: int, payload):
+        """Write a payload to the output file at its final offset"""
+        offset = seq * PAYLOAD_STRIDE
+        if self._file_mmap is not None:
+            self._file_mmap[offset:offset + len(payload)] = payload
+        else:
+            os.pwrite(self._fd, payload, offset)
+        self._bytes_written += len(payload)
+
     def process_buffered_packets(self):
-        """Process packets in order from the reorder buffer"""
-        while self.expected_seq in self.packet_buffer:
-            payload = self.packet_buffer.pop(self.expected_seq)
-            self.received_data.extend(payload)
-            self.expected_seq += 1
-            
-        # Clean up old packets if buffer gets too large
-        if len(self.packet_buffer) > self.max_buffer_size:
-            # Remove oldest packets (lowest sequence numbers)
-            old_seqs = sorted(self.packet_buffer.keys())[:len(self.packet_buffer) - self.max_buffer_size//2]
-            for seq in old_seqs:
-                del self.packet_buffer[seq]
-                print(f"\n⚠ Dropped old packet {seq} (buffer overflow)")
-                
+        """Advance expected_seq across the contiguous run of received packets"""
+        bits = self._received_bits
+        seq = self.expected_seq
+        end = self.expected_packets
+        while seq < end:
+            # Load a 64-bit window at the current position and count the
+            # contiguous run of received packets at its bottom, so dense
+            # runs are skipped 64 sequence numbers per iteration
+            window = int.from_bytes(bits[seq >> 3:(seq >> 3) + 8], 'little') >> (seq & 7)
+            run = ((window + 1) & ~window).bit_length() - 1
+            if run == 0:
+                break
+            seq += run
+        self.expected_seq = min(seq, end)
+
+
     def should_update_progress(self) -> bool:
         """Throttle progress updates for better performance"""
-        current_time = time.time()
+        current_time = time.monotonic()
         if current_time - self.last_progress_update > 0.1:  # Update every 100ms max
             self.last_progress_update = current_time
             return True
         return False
     
-    async def notification_handler(self, sender, data: bytes):
-        """Handle incoming data packets from device with proper reordering"""
-        if len(data) < 8:
-            print(f"Packet too short: {len(data)} bytes")
-            return
-            
+    def _process_packet(self, data) -> int:
+        """Synchronous per-packet critical section: parse, verify, store
+
+        Runs straight-line with no awaits so the common case is a handful
+        of C calls (header unpack, CRC, pwrite, bitmap update). Returns the
+        packet's sequence number, or -1 for EOF and rejected packets.
+        """
         # Parse packet: [seq32|len16|crc16|payload<=236]
-        seq = struct.unpack('<I', data[0:4])[0]
-        length = struct.unpack('<H', data[4:6])[0]
-        crc_received = struct.unpack('<H', data[6:8])[0]
-        payload = data[8:8+length]
-        
+        # Single unpack_from call on a memoryview avoids three struct calls
+        # and the header/payload slice copies per notification
+        mv = memoryview(data)
+        seq, length, crc_received = self._HDR.unpack_from(mv, 0)
+        payload = mv[8:8 + length]
+
         # Check for EOF packet (length = 0, crc = 0)
         if length == 0 and crc_received == 0:
             print(f"\n✓ EOF packet received (seq {seq}) - transfer complete!")
-            self.file_transfer_complete = True
-            return
-        
+            self._done.set()
+            return -1
+
         # Validate packet length
         if len(payload) != length:
             print(f"\nPayload length mismatch: expected {length}, got {len(payload)}")
-            return
-            
-        # Verify CRC (only for data packets, not EOF)
-        crc_calculated = self.crc16_ccitt(payload)
-        if crc_received != crc_calculated:
-            print(f"\nCRC error on packet {seq}: expected {crc_calculated:04x}, got {crc_received:04x}")
-            # Still process packet but note the error
-            
+            return -1
+
         self.total_packets += 1
-        
-        # Handle packet ordering
-        if seq < self.expected_seq:
-            # Duplicate or very old packet, ignore
-            return
-        elif seq == self.expected_seq:
-            # Perfect! This is the next expected packet
-            self.received_data.extend(payload)
-            self.expected_seq += 1
-            
-            # Process any buffered packets that are now in order
-            self.process_buffered_packets()
+
+        # Sanity check sequence number before writing into the buffer
+        if seq >= self.expected_packets:
+            print(f"\nSequence {seq} out of range (expected < {self.expected_packets})")
+            return -1
+
+        # Verify CRC (only for data packets, not EOF). By default just
+        # record the received CRC and verify everything after the transfer
+        if self._strict_crc:
+            crc_calculated = self.crc16_ccitt(payload)
+            if crc_received != crc_calculated:
+                print(f"\nCRC error on packet {seq}: expected {crc_calculated:04x}, got {crc_received:04x}")
+                # Still process packet but note the error
         else:
-            # Out of order packet - buffer it for later
-            if seq not in self.packet_buffer:  # Avoid duplicate buffering
-                self.packet_buffer[seq] = payload
-                
-                # If gap is too large, we might have missed packets - process what we can
-                if seq - self.expected_seq > 50:
-                    print(f"\n⚠ Large gap detected: expected {self.expected_seq}, got {seq}")
-                    # Find the next contiguous sequence we can process
-                    available_seqs = sorted([s for s in self.packet_buffer.keys() if s >= self.expected_seq])
-                    if available_seqs:
-                        # Skip to the next available sequence to avoid waiting forever
-                        next_seq = available_seqs[0]
-                        print(f"  Skipping to packet {next_seq} (gap of {next_seq - self.expected_seq})")
-                        self.expected_seq = next_seq
-                        self.process_buffered_packets()
-        
+            self._packet_crcs[seq] = crc_received
+
+        # Write the packet at its final offset regardless of arrival order,
+        # then mark it received in the bitmap
+        bits = self._received_bits
+        if not (bits[seq >> 3] >> (seq & 7)) & 1:
+            self._write_payload(seq, payload)
+            bits[seq >> 3] |= 1 << (seq & 7)
+            self._packets_stored += 1
+
+            # Advance past any packets that are now contiguous
+            if seq == self.expected_seq:
+                self.process_buffered_packets()
+
+            if self._bytes_written >= self.file_size:
+                self._done.set()
+
+        return seq
+
+    async def notification_handler(self, sender, data: bytes):
+        """Handle incoming data packets from device with proper reordering
+
+        Thin async shim: the hot path lives in _process_packet; only the
+        throttled progress print and credit flushes stay here.
+        """
+        if len(data) < 8:
+            print(f"Packet too short: {len(data)} bytes")
+            return
+
+        seq = self._process_packet(data)
+        if seq < 0:
+            return
+
         # Throttled progress update for better performance
         if self.should_update_progress():
-            progress = (len(self.received_data) / self.file_size) * 100 if self.file_size > 0 else 0
-            elapsed = time.time() - self.start_time
-            speed = len(self.received_data) / elapsed if elapsed > 0 else 0
-            buffered = len(self.packet_buffer)
-            
-            print(f"\rPacket {seq}: {len(self.received_data):,}/{self.file_size:,} bytes "
-                  f"({progress:.1f}%) - {speed/1024:.1f} KB/s [{buffered} buffered]", end='', flush=True)
+            # Reuse the timestamp should_update_progress just took rather
+            # than reading the clock a second time
+            progress = (self._bytes_written / self.file_size) * 100 if self.file_size > 0 else 0
+            elapsed = self.last_progress_update - self.start_time
+            speed = self._bytes_written / elapsed if elapsed > 0 else 0
+            buffered = self._packets_stored - self.expected_seq
+
+            sys.stdout.write(f"\rPacket {seq}: {self._bytes_written:,}/{self._size_str} bytes "
+                             f"({progress:.1f}%) - {speed/1024:.1f} KB/s [{buffered} buffered]")
+            sys.stdout.flush()
         
-        # Optimized credit system for higher throughput
-        # Send credits more aggressively for high-speed transmission
-        if self.total_packets % 2 == 0:  # Every 2 packets instead of 3
-            await self.send_credits(2)  # Send 2 credits at a time for faster flow
+        # Accumulate credits locally and flush in batches; credits are
+        # additive on the device so one big write equals many small ones,
+        # and the initial grant of 64 keeps the sender from draining first
+        self._pending_credits += 1
+        if self._pending_credits >= 16:
+            credits = self._pending_credits
+            self._pending_credits = 0
+            await self.send_credits(credits)
     
-    async def download_file(self) -> bool:
-        """Download the audio file from device"""
+    async def download_file(self, output_dir: str = ".") -> bool:
+        """Download the audio file from device, streaming it to disk"""
         try:
+            # Open the destination up front and preallocate it, so packets
+            # can be written at their final offsets as they arrive instead
+            # of accumulating in memory
+            self._output_path = self._unique_output_path(output_dir)
+            # O_RDWR so the deferred CRC pass can read the data back
+            self._fd = os.open(str(self._output_path), os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+            os.ftruncate(self._fd, self.file_size)
+            if hasattr(os, 'pwrite'):
+                self._file_mmap = None
+            else:
+                # Windows has no pwrite; map the file and slice-assign instead
+                import mmap
+                self._file_mmap = mmap.mmap(self._fd, self.file_size)
+
             # Reset state
-            self.received_data = bytearray()
+            self._bytes_written = 0
+            self.expected_packets = (self.file_size + PAYLOAD_STRIDE - 1) // PAYLOAD_STRIDE
+            self._received_bits = bytearray((self.expected_packets + 7) // 8)
+            self._packet_crcs = array.array('H', bytes(2 * self.expected_packets))
+            self._packets_stored = 0
             self.expected_seq = 0
             self.total_packets = 0
             self.credits_sent = 0
-            self.start_time = time.time()
-            self.file_transfer_complete = False
-            self.packet_buffer.clear()
+            self._pending_credits = 0
+            self.start_time = time.monotonic()
+            self._done = asyncio.Event()
             self.last_progress_update = 0
             
+            # Resolve characteristics once so every GATT call afterwards
+            # skips the UUID lookup
+            try:
+                self._tx_data_char = self.client.services.get_characteristic(UUID_TX_DATA)
+                self._rx_credits_char = self.client.services.get_characteristic(UUID_RX_CREDITS)
+            except Exception:
+                self._tx_data_char = None
+                self._rx_credits_char = None
+
             # Subscribe to notifications
-            await self.client.start_notify(UUID_TX_DATA, self.notification_handler)
+            await self.client.start_notify(self._tx_data_char or UUID_TX_DATA, self.notification_handler)
             print("\n✓ Subscribed to data notifications")
             
             # Send initial credits (aggressive for high-speed transmission)
             await self.send_credits(64)  # Max credits to start fast
             print("✓ Sent initial credits (64 for high-speed mode)")
             
-            # Wait for download to complete
+            # Wait for completion; the notification handler sets the event on
+            # EOF or when the last byte lands, so there is no polling latency
             print("Downloading...")
             last_received = 0
-            stall_count = 0
-            
-            while len(self.received_data) < self.file_size and not self.file_transfer_complete:
-                await asyncio.sleep(0.5)
-                
-                # Check if EOF packet received
-                if self.file_transfer_complete:
+
+            while not self._done.is_set():
+                try:
+                    await asyncio.wait_for(self._done.wait(), timeout=10)
                     break
-                
-                # Check for stalled transfer
-                if len(self.received_data) == last_received:
-                    stall_count += 1
-                    if stall_count > 20:  # 10 seconds of no progress (longer for high-speed)
-                        # Check if we're at 99%+ complete (fallback for old protocol)
-                        progress = (len(self.received_data) / self.file_size) * 100 if self.file_size > 0 else 0
-                        if progress >= 99.0:
-                            print(f"\n✓ Transfer nearly complete at {progress:.1f}% - accepting as done")
-                            break
-                        
-                        print(f"\n⚠ Transfer stalled at {len(self.received_data)} bytes ({progress:.1f}%)")
-                        print(f"   Buffer contains {len(self.packet_buffer)} out-of-order packets")
-                        
-                        # For high-speed mode, send more credits and be more aggressive
-                        await self.send_credits(32)
-                        stall_count = 0
-                        
-                        # If we have buffered packets, try to process them
-                        if self.packet_buffer:
-                            print("   Attempting to process buffered packets...")
-                            # Find the lowest sequence number we can start from
-                            min_buffered_seq = min(self.packet_buffer.keys())
-                            if min_buffered_seq - self.expected_seq <= 10:  # Small gap, skip ahead
-                                print(f"   Skipping gap: {self.expected_seq} -> {min_buffered_seq}")
-                                self.expected_seq = min_buffered_seq
-                                self.process_buffered_packets()
-                else:
-                    stall_count = 0
-                    last_received = len(self.received_data)
-                
+                except asyncio.TimeoutError:
+                    pass
+
+                if self._bytes_written != last_received:
+                    last_received = self._bytes_written
+                    continue
+
+                # No progress for a whole wait interval: transfer stalled
+                # Check if we're at 99%+ complete (fallback for old protocol)
+                progress = (self._bytes_written / self.file_size) * 100 if self.file_size > 0 else 0
+                if progress >= 99.0:
+                    print(f"\n✓ Transfer nearly complete at {progress:.1f}% - accepting as done")
+                    break
+
+                out_of_order = self._packets_stored - self.expected_seq
+                print(f"\n⚠ Transfer stalled at {self._bytes_written} bytes ({progress:.1f}%)")
+                print(f"   {out_of_order} packets received past the gap at {self.expected_seq}")
+
+                # For high-speed mode, send more credits and be more
+                # aggressive; include any batched credits not yet flushed
+                credits = 32 + self._pending_credits
+                self._pending_credits = 0
+                await self.send_credits(credits)
+
                 # Timeout check (60 seconds without any data)
-                elapsed = time.time() - self.start_time
-                if elapsed > 60 and len(self.received_data) == 0:
+                elapsed = time.monotonic() - self.start_time
+                if elapsed > 60 and self._bytes_written == 0:
                     print("\nTimeout: No data received")
+                    await self.client.stop_notify(self._tx_data_char or UUID_TX_DATA)
+                    self._discard_output()
                     return False
             
             # Stop notifications
-            await self.client.stop_notify(UUID_TX_DATA)
-            
+            await self.client.stop_notify(self._tx_data_char or UUID_TX_DATA)
+
+            # Deferred CRC verification over the whole file in one pass
+            if not self._strict_crc:
+                bad = self._verify_crcs()
+                if bad:
+                    shown = ', '.join(str(s) for s in bad[:10])
+                    more = '...' if len(bad) > 10 else ''
+                    print(f"\n⚠ CRC mismatch on {len(bad)} packets: {shown}{more}")
+
             # Final statistics
-            elapsed = time.time() - self.start_time
-            avg_speed = len(self.received_data) / elapsed if elapsed > 0 else 0
+            elapsed = time.monotonic() - self.start_time
+            avg_speed = self._bytes_written / elapsed if elapsed > 0 else 0
             
-            print(f"\n✓ Download complete: {len(self.received_data):,} bytes in {self.total_packets} packets")
+            print(f"\n✓ Download complete: {self._bytes_written:,} bytes in {self.total_packets} packets")
             print(f"  Average speed: {avg_speed/1024:.1f} KB/s")
             print(f"  Total time: {elapsed:.1f} seconds")
-            if self.packet_buffer:
-                print(f"  Warning: {len(self.packet_buffer)} packets still in reorder buffer")
+            missing = self.expected_packets - self._packets_stored
+            if missing > 0 and self._bytes_written < self.file_size:
+                print(f"  Warning: {missing} packets never arrived")
                 
             return True
             
         except Exception as e:
             print(f"\nDownload error: {e}")
+            self._discard_output()
             return False
-    
-    async def save_file(self, output_dir: str = ".") -> bool:
-        """Save received data to file"""
+
+    def _read_back(self, offset: int, length: int) -> bytes:
+        """Read a slice of the output file back for verification"""
+        if self._file_mmap is not None:
+            return self._file_mmap[offset:offset + length]
+        return os.pread(self._fd, length, offset)
+
+    def _verify_crcs(self) -> list:
+        """Check the recorded packet CRCs against the on-disk data
+
+        Runs once after the transfer so the per-packet hot path only has to
+        store each received CRC. Re-reads the file in ranges across a small
+        thread pool and returns the sequence numbers that fail.
+        """
+        packets = self.expected_packets
+        if packets == 0 or self._fd is None:
+            return []
+
+        bits = self._received_bits
+        crcs = self._packet_crcs
+        crc = self.crc16_ccitt
+        last = packets - 1
+
+        def check_range(start, stop):
+            bad = []
+            for seq in range(start, stop):
+                if not (bits[seq >> 3] >> (seq & 7)) & 1:
+                    continue
+                offset = seq * PAYLOAD_STRIDE
+                length = PAYLOAD_STRIDE if seq < last else self.file_size - offset
+                if crc(self._read_back(offset, length)) != crcs[seq]:
+                    bad.append(seq)
+            return bad
+
+        workers = min(4, packets)
+        step = (packets + workers - 1) // workers
+        ranges = [(i, min(i + step, packets)) for i in range(0, packets, step)]
+        bad = []
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for chunk in pool.map(lambda r: check_range(*r), ranges):
+                bad.extend(chunk)
+        return sorted(bad)
+
+    def _unique_output_path(self, output_dir: str) -> Path:
+        """Pick an output path that does not clobber an existing file"""
+        output_path = Path(output_dir) / self.file_name
+        if not output_path.exists():
+            return output_path
+
+        # One directory listing instead of a stat call per candidate name:
+        # find the highest existing _N suffix and go one past it
+        stem, suffix = output_path.stem, output_path.suffix
+        next_n = 1 + max(
+            (int(p.stem.rsplit('_', 1)[1])
+             for p in output_path.parent.glob(f"{stem}_[0-9]*{suffix}")
+             if p.stem.rsplit('_', 1)[1].isdigit()),
+            default=0,
+        )
+        return output_path.parent / f"{stem}_{next_n}{suffix}"
+
+    def _close_output(self):
+        """Release the output file handle and mapping, if open"""
+        if self._file_mmap is not None:
+            self._file_mmap.close()
+            self._file_mmap = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _discard_output(self):
+        """Close the output file, removing it if nothing was received
+
+        Used on failure paths so an aborted download does not leave a
+        zero-filled preallocated file on disk masquerading as a recording.
+        """
+        self._close_output()
+        if self._bytes_written == 0 and self._output_path is not None:
+            try:
+                os.unlink(self._output_path)
+            except OSError:
+                pass
+            self._output_path = None
+
+    async def save_file(self) -> bool:
+        """Finalize the output file written during download"""
         try:
-            output_path = Path(output_dir) / self.file_name
-            
-            # Avoid overwriting existing files
-            counter = 1
-            original_path = output_path
-            while output_path.exists():
-                name_parts = original_path.stem, counter, original_path.suffix
-                output_path = original_path.parent / f"{name_parts[0]}_{name_parts[1]}{name_parts[2]}"
-                counter += 1
-            
-            with open(output_path, 'wb') as f:
-                f.write(self.received_data)
-            
-            print(f"✓ File saved: {output_path} ({len(self.received_data):,} bytes)")
+            if self._file_mmap is not None:
+                self._file_mmap.flush()
+            if self._fd is not None:
+                os.fsync(self._fd)
+            self._close_output()
+
+            print(f"✓ File saved: {self._output_path} ({self._bytes_written:,} bytes)")
             return True
-            
+
         except Exception as e:
             print(f"Save error: {e}")
             return False
@@ -381,39 +607,47 @@ async def main():
     parser.add_argument('--timeout', type=int, default=10, help='Scan timeout (default: 10s)')
     parser.add_argument('--output-dir', default='.', help='Output directory (default: current)')
     parser.add_argument('--verbose', '-v', action='store_true', help='Verbose output')
-    
+    parser.add_argument('--strict-crc', action='store_true',
+                        help='Verify each packet CRC as it arrives instead of once at the end')
+
     args = parser.parse_args()
-    
-    receiver = XiaoAudioReceiver()
+
+    receiver = XiaoAudioReceiver(strict_crc=args.strict_crc)
     
     try:
-        # Scan for device
-        if args.device_address:
-            # Create device object from address
-            device = None
-            devices = await BleakScanner.discover(timeout=args.timeout)
-            for d in devices:
-                if d.address.lower() == args.device_address.lower():
-                    device = d
-                    break
-            if not device:
-                print(f"Device {args.device_address} not found")
-                return
+        if args.device_address and not args.scan_only:
+            # A known address needs no discovery scan; connect directly and
+            # only fall back to scanning if the backend requires one
+            connected = await receiver.connect_to_address(args.device_address)
+            if not connected:
+                print("Direct connection failed, scanning for device...")
+                devices = await BleakScanner.discover(timeout=args.timeout)
+                device = None
+                for d in devices:
+                    if d.address.lower() == args.device_address.lower():
+                        device = d
+                        break
+                if not device:
+                    print(f"Device {args.device_address} not found")
+                    return
+                connected = await receiver.connect_to_device(device)
         else:
             device = await receiver.scan_for_device(args.timeout)
             if not device:
                 return
-        
-        if args.scan_only:
-            print("Scan complete")
-            return
-        
-        # Connect and download
-        if await receiver.connect_to_device(device):
+
+            if args.scan_only:
+                print("Scan complete")
+                return
+
+            connected = await receiver.connect_to_device(device)
+
+        # Download once connected
+        if connected:
             if await receiver.read_file_info():
                 if receiver.file_size > 0:
-                    if await receiver.download_file():
-                        await receiver.save_file(args.output_dir)
+                    if await receiver.download_file(args.output_dir):
+                        await receiver.save_file()
                     else:
                         print("Download failed")
                 else:
@@ -431,4 +665,12 @@ async def main():
         await receiver.disconnect()
 
 if __name__ == '__main__':
+    try:
+        # uvloop's libuv-based loop dispatches the many small notification
+        # callbacks 2-3x faster than vanilla asyncio (not available on
+        # Windows, which keeps the default event loop)
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        print("Tip: 'pip install uvloop' for faster transfers (optional)")
     asyncio.run(main())
\ No newline at end of file